@@ -25,6 +25,8 @@ import argparse
 from abc import ABC, abstractmethod
 from collections.abc import Sequence
 
+from lsst.daf.butler import CollectionType
+
 from ._constants import MISC_INPUT_RUN
 from .mock_dataset_maker import MockDatasetMaker
 from .repo_data import RepoData
@@ -71,6 +73,20 @@ class PrepForPipeline(Tool):
         MockDatasetMaker.prep(args.root, args.pipeline, args.run)
 
 
+class PrepAndChain(PrepForPipeline):
+    def __init__(self, parser: argparse.ArgumentParser):
+        super().__init__(parser)
+        parser.add_argument("chain", help="Name of the CHAINED collection to define.")
+        parser.add_argument(
+            "children", nargs="+", help="Collections whose flattened contents should form the chain."
+        )
+
+    def __call__(self, args: argparse.Namespace) -> None:
+        maker = MockDatasetMaker.prep(args.root, args.pipeline, args.run)
+        maker.butler.registry.registerCollection(args.chain, CollectionType.CHAINED)
+        maker.butler.registry.setCollectionChain(args.chain, args.children, flatten=True)
+
+
 class Display(Tool):
     def __init__(self, parser: argparse.ArgumentParser):
         super().__init__(parser)
@@ -119,6 +135,15 @@ def main(argv: Sequence[str]) -> None:
             help="Add mocked input datasets and formatter configuration to a data repository.",
         )
     )
+    PrepAndChain(
+        subparsers.add_parser(
+            "prep-and-chain",
+            help=(
+                "Add mocked input datasets and formatter configuration to a data repository, "
+                "and define a flattened CHAINED collection."
+            ),
+        )
+    )
     Display(
         subparsers.add_parser("display", help="Display of all spatial data ID regions in a data repository.")
     )
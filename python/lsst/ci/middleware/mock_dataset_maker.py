@@ -59,7 +59,7 @@ class MockDatasetMaker:
     )
 
     @classmethod
-    def prep(cls, root: str, uri: ResourcePathExpression, run: str = MISC_INPUT_RUN) -> None:
+    def prep(cls, root: str, uri: ResourcePathExpression, run: str = MISC_INPUT_RUN) -> MockDatasetMaker:
         """Add mock input datasets for a pipeline and set up butler formatter
         configuration for all dataset types in that pipeline.
 
@@ -72,6 +72,12 @@ class MockDatasetMaker:
         run : `str`, optional
             RUN collection that mock datasets should be written to.
 
+        Returns
+        -------
+        maker : `MockDatasetMaker`
+            The helper used to add the datasets, holding the writeable butler
+            client for further modifications.
+
         Notes
         -----
         This both registers dataset types and adds mock datasets.  If an
@@ -83,6 +89,7 @@ class MockDatasetMaker:
         butler = Butler.from_config(root, writeable=True, run=run)
         maker = cls(butler)
         maker.make_inputs(mocked, run)
+        return maker
 
     def make_inputs(self, graph: PipelineGraph, run: str = MISC_INPUT_RUN) -> None:
         """Add mock input datasets for a pipeline.
@@ -149,17 +156,22 @@ class MockDatasetMaker:
                 data_ids = frozenset(next_data_ids)
                 dimensions = next_dimensions
                 self.cached_data_ids[dimensions] = data_ids
-        for data_id in data_ids:
-            ref = DatasetRef(dataset_type, data_id, run=run)
-            self.butler.put(
-                MockDataset(
-                    dataset_id=ref.id,
-                    dataset_type=dataset_type.to_simple(),
-                    data_id=dict(data_id.mapping),
-                    run=run,
-                ),
-                ref,
-            )
+        # Write all datasets of this type in a single registry transaction,
+        # rather than committing (and syncing the SQLite file) once per put.
+        # Dataset type registration stays outside, since it may need to
+        # create tables.
+        with self.butler.transaction():
+            for data_id in data_ids:
+                ref = DatasetRef(dataset_type, data_id, run=run)
+                self.butler.put(
+                    MockDataset(
+                        dataset_id=ref.id,
+                        dataset_type=dataset_type.to_simple(),
+                        data_id=dict(data_id.mapping),
+                        run=run,
+                    ),
+                    ref,
+                )
 
     @property
     def spatial_bounds(self) -> Box:
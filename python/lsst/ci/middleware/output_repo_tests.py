@@ -25,7 +25,7 @@ __all__ = ("OutputRepoTests",)
 
 import tarfile
 import unittest
-from collections.abc import Mapping
+from collections.abc import Mapping, Set
 from pathlib import Path
 from typing import cast
 
@@ -54,7 +54,7 @@ class OutputRepoTests:
         "direct" or "qbb".
     expected : `~collections.abc.Mapping`
         Expected data ID values and their relationships, as a mapping from
-        ``(tract, patch, band)`` tuple to a `set` of ``visits`` that should
+        ``(tract, patch, band)`` tuple to a set of ``visits`` that should
         contribute to the coadd for that ``(tract, patch, band)``.  Values
         may also be `None` to indicate a coadd that should be produced but
         whose inputs visits need not be checked.
@@ -72,18 +72,26 @@ class OutputRepoTests:
     particular test method).
     """
 
-    def __init__(self, name: str, variant: str, expected: Mapping[tuple[int, int, str], set[int] | None]):
+    def __init__(self, name: str, variant: str, expected: Mapping[tuple[int, int, str], Set[int] | None]):
         self.name = name
         self.variant = variant
         self.expected = expected
         self._root: str | None = None
         self._butler: Butler | None = None
+        self._quantum_graphs: dict[str, QuantumGraph] = {}
 
     @property
     def butler(self) -> Butler:
         if self._butler is None:
             self._root = makeTestTempDir(str(TEST_DIR))
-            with tarfile.open(DATA_DIR.joinpath(self.name, f"{self.variant}.tgz")) as archive:
+            # Side runs are left as the uncompressed archives written by the
+            # build; only the final direct and qbb repositories are
+            # compressed.  Look for the .tar first, since an older build may
+            # have left a stale .tgz for a side run.
+            archive_path = DATA_DIR.joinpath(self.name, f"{self.variant}.tar")
+            if not archive_path.exists():
+                archive_path = archive_path.with_suffix(".tgz")
+            with tarfile.open(archive_path) as archive:
                 archive.extractall(self._root)
             self._butler = Butler.from_config(self._root, collections=f"HSC/runs/{self.name}")
         return self._butler
@@ -93,13 +101,20 @@ class OutputRepoTests:
         execution.
 
         Note that there is only one QuantumGraph for all variants.
+
+        Graphs are cached after they are first read, so the returned object
+        is shared and should not be modified.
         """
         if step is None:
             step = "full"
         terms = [step]
         if group is not None:
             terms.append(group)
-        return QuantumGraph.loadUri(DATA_DIR.joinpath(self.name, "-".join(terms) + ".qgraph"))
+        basename = "-".join(terms)
+        if (qg := self._quantum_graphs.get(basename)) is None:
+            qg = QuantumGraph.loadUri(DATA_DIR.joinpath(self.name, basename + ".qgraph"))
+            self._quantum_graphs[basename] = qg
+        return qg
 
     def close(self) -> None:
         """Delete the temporary data repository.
@@ -23,12 +23,17 @@ from __future__ import annotations
 
 __all__ = (
     "python_cmd",
+    "setup_packages_signature",
     "tar_repo_cmd",
     "untar_repo_cmd",
     "PipelineCommands",
 )
 
+import hashlib
+import itertools
 import os
+import shutil
+import subprocess
 from collections.abc import Iterable, Sequence
 
 from lsst.sconsUtils import state
@@ -41,8 +46,41 @@ PIPETASK_BIN = os.path.join(os.environ["CTRL_MPEXEC_DIR"], "bin/pipetask")
 BUTLER_BIN = os.path.join(os.environ["DAF_BUTLER_DIR"], "bin/butler")
 COVERAGE_PACKAGES = ",".join(["lsst.daf.butler", "lsst.pipe.base", "lsst.ctrl.mpexec"])
 
+# Use parallel gzip when it is available; it produces byte-compatible output.
+# The -n option keeps the file name and timestamp out of the gzip header.
+GZIP_CMD = "pigz -n" if shutil.which("pigz") else "gzip -n"
 
-def python_cmd(*args: str, expect_failure: bool = False) -> str:
+# Read and write tar archives in 512 KiB records (1024 x 512 B blocks) instead
+# of the default 10 KiB, which cuts the number of I/O system calls for the
+# many small files in a data repository.
+TAR_BLOCKING_FACTOR = 1024
+
+
+def _tar_reproducible_options() -> str:
+    """Return GNU tar options that make archives depend only on the names
+    and content of the files in them, so identical repositories yield
+    identical archives (and SCons, or its CacheDir, can see that).
+
+    Other tar implementations (e.g. bsdtar on macOS) do not support these
+    options, so an empty string is returned for them.
+    """
+    try:
+        version = subprocess.run(["tar", "--version"], capture_output=True, text=True).stdout
+    except OSError:
+        return ""
+    if "GNU tar" not in version:
+        return ""
+    return "--sort=name --mtime=@0 --owner=0 --group=0 --numeric-owner"
+
+
+_TAR_REPRODUCIBLE_OPTIONS = _tar_reproducible_options()
+
+# The library loader environment prefix depends only on the environment of
+# the SCons process, so we compute it once rather than on every command.
+_LIB_LOADER_ENV = libraryLoaderEnvironment()
+
+
+def python_cmd(*args: str, expect_failure: bool = False, no_fsync: bool = False) -> str:
     """Return a command-line string that runs the Python executable.
 
     Parameters
@@ -52,20 +90,91 @@ def python_cmd(*args: str, expect_failure: bool = False) -> str:
     expect_failure : `bool`
         If `True`, expect the pipetask command to fail with a nonzero exit
         code, and guard it accordingly to keep the SCons build running.
+    no_fsync : `bool`
+        If `True`, run Python under ``eatmydata``, which turns ``fsync`` and
+        friends into no-ops.  This makes SQLite registry commits much
+        cheaper, at the expense of crash durability we don't need for test
+        data repositories.  ``eatmydata`` must be installed.
 
     Returns
     -------
     cmd : `str`
         A command-line string.
     """
-    terms = [libraryLoaderEnvironment(), "python"]
+    terms = [_LIB_LOADER_ENV]
+    if no_fsync:
+        terms.append("eatmydata")
+    terms.append("python")
     terms.extend(args)
     if expect_failure:
         terms.extend(["||", "true"])
     return " ".join(terms)
 
 
-def tar_repo_cmd(input_dir: str, output_tar: str) -> str:
+# Suffixes of untracked files in local checkouts that are included in
+# setup_packages_signature.
+_SIGNATURE_SOURCE_SUFFIXES = (".py", ".yaml", ".yml", ".cfg")
+
+
+def setup_packages_signature() -> str:
+    """Return a string that changes whenever the code of any EUPS-setup
+    package might have changed.
+
+    Returns
+    -------
+    signature : `str`
+        Multi-line string with the ``SETUP_*`` value of each setup package.
+        For packages set up from a local directory (e.g. ``setup -r``), this
+        is followed by the git commit and a digest of any uncommitted
+        changes and untracked source files, since the version string does
+        not change when the code does.
+
+    Notes
+    -----
+    This is intended to be wrapped in an SCons ``Value`` node that all
+    targets depend on, so a derived-file cache (``CacheDir``) is not used
+    to restore targets built with other versions of the middleware or
+    pipeline code.
+    """
+    lines = []
+    for key, setup in sorted(os.environ.items()):
+        if not key.startswith("SETUP_"):
+            continue
+        lines.append(f"{key}={setup}")
+        if "LOCAL:" not in setup:
+            continue
+        directory = os.environ.get(key.removeprefix("SETUP_") + "_DIR")
+        if directory is None:
+            continue
+        git = ["git", "-C", directory]
+        head = subprocess.run([*git, "rev-parse", "HEAD"], capture_output=True, text=True)
+        if head.returncode != 0:
+            # Not a git checkout; we can only rely on the directory.
+            lines.append(f"  {directory}")
+            continue
+        changes = hashlib.sha1()
+        changes.update(subprocess.run([*git, "diff", "HEAD"], capture_output=True).stdout)
+        untracked = subprocess.run(
+            [*git, "ls-files", "-z", "--others", "--exclude-standard"], capture_output=True, text=True
+        ).stdout
+        for name in filter(None, untracked.split("\0")):
+            # Only new source files matter; build state such as .sconsign.dblite
+            # and config.log is rewritten by every build and must not change
+            # the signature.
+            path = os.path.join(directory, name)
+            if not name.endswith(_SIGNATURE_SOURCE_SUFFIXES) or os.path.islink(path):
+                continue
+            if not os.path.isfile(path):
+                continue
+            changes.update(name.encode())
+            with open(path, "rb") as stream:
+                while chunk := stream.read(1 << 20):
+                    changes.update(chunk)
+        lines.append(f"  {head.stdout.strip()} {changes.hexdigest()}")
+    return "\n".join(lines)
+
+
+def tar_repo_cmd(input_dir: str, output_tar: str, compress: bool = True) -> str:
     """Return a command-line string that tars up a data repository.
 
     Parameters
@@ -74,7 +183,10 @@ def tar_repo_cmd(input_dir: str, output_tar: str) -> str:
         Path to the data repository.  Will be deleted as the tar archive is
         created.
     output_tar : `str`
-        Name of the output tar file.  Should reflect gzip compression.
+        Name of the output tar file.  Should reflect gzip compression if
+        ``compress`` is `True`.
+    compress : `bool`, optional
+        Whether to gzip-compress the archive (with ``pigz`` if available).
 
     Returns
     -------
@@ -88,8 +200,18 @@ def tar_repo_cmd(input_dir: str, output_tar: str) -> str:
     some subdirectory of it) into a data repository.  This makes it easier to
     extract the data repository into a location that is different from the
     original one.
+
+    When GNU tar is in use, file order, modification times, and ownership are
+    normalized so that the archive is reproducible.
     """
-    return f"tar -czf {output_tar} -C {input_dir} . && rm -rf {input_dir}"
+    tar = " ".join(filter(None, ["tar", f"-b {TAR_BLOCKING_FACTOR}", _TAR_REPRODUCIBLE_OPTIONS]))
+    if compress:
+        # Pipe to the compressor rather than using GNU tar's -I option, which
+        # means something else to bsdtar.
+        create = f"{tar} -cf - -C {input_dir} . | {GZIP_CMD} > {output_tar}"
+    else:
+        create = f"{tar} -cf {output_tar} -C {input_dir} ."
+    return f"{create} && rm -rf {input_dir}"
 
 
 def untar_repo_cmd(source_tar: str, output_dir: str) -> str:
@@ -98,9 +220,9 @@ def untar_repo_cmd(source_tar: str, output_dir: str) -> str:
     Parameters
     ----------
     source_tar : `str`
-        Path to the input tar file.  Should be gzip-compressed and hold data
-        repository contents in the root of the archive, not some subdirectory
-        (see `tar_repo_cmd`).
+        Path to the input tar file.  May be gzip-compressed or uncompressed,
+        and should hold data repository contents in the root of the archive,
+        not some subdirectory (see `tar_repo_cmd`).
     output_dir : `str`
         Path to the output repository.
 
@@ -109,7 +231,10 @@ def untar_repo_cmd(source_tar: str, output_dir: str) -> str:
     cmd : `str`
         A command-line string.
     """
-    return f"rm -rf {output_dir} && mkdir {output_dir} && tar -C {output_dir} -xzf {source_tar}"
+    return (
+        f"rm -rf {output_dir} && mkdir -p {output_dir} && "
+        f"tar -b {TAR_BLOCKING_FACTOR} -C {output_dir} -xf {source_tar}"
+    )
 
 
 class PipelineCommands:
@@ -131,6 +256,18 @@ class PipelineCommands:
     run_template : `str`, optional
         Format string for RUN output collections; should have ``name`` and
         ``suffix`` placeholders.
+    coverage : `bool`, optional
+        Whether to have ``pipetask`` write coverage information for the
+        middleware packages.  This slows down execution noticeably.
+    scratch_root : `str`, optional
+        Directory in which to put the temporary data repositories each build
+        step works on before archiving them (e.g. a ``tmpfs`` mount, to keep
+        them out of the filesystem the build is on).  If `None` (default),
+        these are created next to the archives.  Must not be shared by
+        concurrent builds.
+    no_fsync : `bool`, optional
+        Whether to run all Python commands under ``eatmydata``; see
+        `python_cmd`.
 
     Notes
     -----
@@ -147,7 +284,9 @@ class PipelineCommands:
       repository is used as the input data repository for the next `add` step.
 
     This approach of using ``tar`` archives to copy data repositories for each
-    step does lead to a lot of I/O, but it also has some major advantages:
+    step does lead to a lot of I/O (though the archives for intermediate steps
+    are not compressed, and only the final ones returned by `finish` are), but
+    it also has some major advantages:
 
     - SCons is much better at managing dependencies between file targets than
       directory targets.
@@ -168,12 +307,23 @@ class PipelineCommands:
         base_repo: File,
         chain_template: str = "HSC/runs/{name}",
         run_template: str = "HSC/runs/{name}/{suffix}",
+        coverage: bool = True,
+        scratch_root: str | None = None,
+        no_fsync: bool = False,
     ):
         self.name = name
         self.pipeline_path = pipeline_path
         self.chain = chain_template.format(name=self.name)
         self.run_template = run_template
-        self.all_targets: list[File] = []
+        self.scratch_root = scratch_root
+        self.no_fsync = no_fsync
+        # Options appended to every pipetask command, built only once.
+        self._pipetask_coverage_args: tuple[str, ...] = (
+            ("--coverage", f"--cov-packages {COVERAGE_PACKAGES}", "--no-cov-report") if coverage else ()
+        )
+        # Lists of SCons nodes returned by each Command call; these are only
+        # flattened into a single list by `finish`.
+        self._target_chunks: list[Sequence[File]] = []
         inputs_repo = self._make_inputs_repo(base_repo)
         self.last_direct_repo: File = inputs_repo
         self.last_qbb_repo: File = inputs_repo
@@ -356,21 +506,23 @@ class PipelineCommands:
             List of SCons file-target nodes, representing everything produced
             for this pipeline.
         """
-        self.all_targets.extend(
+        # Intermediate repositories are uncompressed tar files; the final ones
+        # are the only ones we compress.
+        self._target_chunks.append(
             state.env.Command(
                 [File(f"{self.name}/direct.tgz")],
                 [self.last_direct_repo],
-                ["ln -s ${SOURCE.abspath} ${TARGET}"],
+                [f"{GZIP_CMD} -c ${{SOURCE}} > ${{TARGET}}"],
             )
         )
-        self.all_targets.extend(
+        self._target_chunks.append(
             state.env.Command(
                 [File(f"{self.name}/qbb.tgz")],
                 [self.last_qbb_repo],
-                ["ln -s ${SOURCE.abspath} ${TARGET}"],
+                [f"{GZIP_CMD} -c ${{SOURCE}} > ${{TARGET}}"],
             )
         )
-        return self.all_targets
+        return list(itertools.chain.from_iterable(self._target_chunks))
 
     def _make_inputs_repo(self, base_repo: File) -> File:
         """Make a SCons target for the pipeline-input data repository.
@@ -387,32 +539,28 @@ class PipelineCommands:
         inputs_repo : `SCons.Script.File`
             SCons file node for the input repo.
         """
-        repo_file = f"{self.name}/inputs.tgz"
-        repo_in_cmd = "${TARGET.base}"
+        repo_file = f"{self.name}/inputs.tar"
+        repo_in_cmd = self._repo_dir("${TARGET.base}", "inputs")
         targets = state.env.Command(
             [repo_file],  # target
             [base_repo, File(self.pipeline_path)],  # sources
             [
                 untar_repo_cmd("${SOURCE}", repo_in_cmd),
+                # Add mocked inputs, and (in the same process) add the output
+                # collection up front as a flattened version of the inputs.
+                # Execution steps will prepend to this.
                 python_cmd(
-                    "-m lsst.ci.middleware prep-for-pipeline",
+                    "-m lsst.ci.middleware prep-and-chain",
                     repo_in_cmd,  # data repository
                     "${SOURCES[1]}",  # pipeline file path
-                ),
-                # Add the output collection up front as a flattened version
-                # of the inputs.  Execution steps will prepend to this.
-                python_cmd(
-                    BUTLER_BIN,
-                    "collection-chain",
-                    repo_in_cmd,
-                    "--flatten",
                     self.chain,
                     DEFAULTS_COLLECTION,
+                    no_fsync=self.no_fsync,
                 ),
-                tar_repo_cmd(repo_in_cmd, "${TARGET}"),
+                tar_repo_cmd(repo_in_cmd, "${TARGET}", compress=False),
             ],
         )
-        self.all_targets.extend(targets)
+        self._target_chunks.append(targets)
         return targets[0]
 
     def _add_qg(
@@ -460,7 +608,7 @@ class PipelineCommands:
         """
         qg_file = os.path.join(self.name, suffix + ".qgraph")
         log = os.path.join(self.name, suffix + "-qgraph.log")
-        repo_in_cmd = "${TARGETS[0].base}-qgraph-repo"
+        repo_in_cmd = self._repo_dir("${TARGETS[0].base}-qgraph-repo", f"{suffix}-qgraph-repo")
         fail_and_retry_args = [f"--mock-failure {f}" for f in fail]
         if skip_existing_in_last:
             fail_and_retry_args.append(f"--skip-existing-in {self.chain}")
@@ -504,7 +652,7 @@ class PipelineCommands:
                 f"rm -r {repo_in_cmd}",
             ],
         )
-        self.all_targets.extend(targets)
+        self._target_chunks.append(targets)
         return targets[0]
 
     def _add_direct(
@@ -546,9 +694,9 @@ class PipelineCommands:
         inputs_repo : `SCons.Script.File`
             SCons file node for the output repo.
         """
-        repo_file = os.path.join(self.name, suffix + "-direct.tgz")
+        repo_file = os.path.join(self.name, suffix + "-direct.tar")
         log = os.path.join(self.name, suffix + "-direct.log")
-        repo_in_cmd = "${TARGETS[0].base}"
+        repo_in_cmd = self._repo_dir("${TARGETS[0].base}", f"{suffix}-direct")
         extra_args = []
         if extend_run:
             extra_args.append("--extend-run")
@@ -577,6 +725,7 @@ class PipelineCommands:
                 *extra_args,
                 log="${TARGETS[1]}",
                 expect_failure=expect_failure,
+            no_fsync=self.no_fsync,
             ),
         ]
         if auto_retry_mem:
@@ -596,7 +745,7 @@ class PipelineCommands:
                     expect_failure=False,
                 )
             )
-        cmds.append(tar_repo_cmd(repo_in_cmd, "${TARGETS[0]}"))
+        cmds.append(tar_repo_cmd(repo_in_cmd, "${TARGETS[0]}", compress=False))
         targets = state.env.Command(
             [File(repo_file), File(log)],
             # We use the last QBB repo as input, even for direct executions
@@ -604,7 +753,7 @@ class PipelineCommands:
             [self.last_qbb_repo, qg_file],
             cmds,
         )
-        self.all_targets.extend(targets)
+        self._target_chunks.append(targets)
         return targets[0]
 
     def _add_qbb(
@@ -644,9 +793,9 @@ class PipelineCommands:
         inputs_repo : `SCons.Script.File`
             SCons file node for the output repo.
         """
-        repo_file = os.path.join(self.name, suffix + "-qbb.tgz")
+        repo_file = os.path.join(self.name, suffix + "-qbb.tar")
         log = os.path.join(self.name, suffix + "-qbb.log")
-        repo_in_cmd = "${TARGETS[0].base}"
+        repo_in_cmd = self._repo_dir("${TARGETS[0].base}", f"{suffix}-qbb")
         commands = [
             # Untar the input data repository, which naturally makes a copy of
             # it, with the name we'll use for the output data repository.
@@ -701,17 +850,39 @@ class PipelineCommands:
                 "--no-transfer-dimensions",
                 "--update-output-chain",
                 "--register-dataset-types",
+                no_fsync=self.no_fsync,
             ),
-            tar_repo_cmd(repo_in_cmd, "${TARGETS[0]}"),
+            tar_repo_cmd(repo_in_cmd, "${TARGETS[0]}", compress=False),
         ]
         targets = state.env.Command(
             [File(repo_file), File(log)],
             [self.last_qbb_repo, qg_file],
             commands,
         )
-        self.all_targets.extend(targets)
+        self._target_chunks.append(targets)
         return targets[0]
 
+    def _repo_dir(self, default: str, name: str) -> str:
+        """Return the path to use for a temporary data repository directory.
+
+        Parameters
+        ----------
+        default : `str`
+            Path (usually an SCons substitution expression) to use if
+            ``scratch_root`` was not provided at construction.
+        name : `str`
+            Name for the directory that is unique within this pipeline, used
+            if ``scratch_root`` was provided at construction.
+
+        Returns
+        -------
+        path : `str`
+            Path to the directory.
+        """
+        if self.scratch_root is None:
+            return default
+        return os.path.join(self.scratch_root, self.name, name)
+
     def _pipetask_cmd(self, subcommand: str, *args: str, log: str, expect_failure: bool = False) -> str:
         """Return a command-line string that runs ``pipetask``` with options
         common to all invocations for this pipeline.
@@ -740,8 +911,6 @@ class PipelineCommands:
             "--no-log-tty",
             subcommand,
             *args,
-            "--coverage",
-            f"--cov-packages {COVERAGE_PACKAGES}",
-            "--no-cov-report",
+            *self._pipetask_coverage_args,
             expect_failure=expect_failure,
         )
@@ -20,6 +20,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+from types import MappingProxyType
 from typing import ClassVar
 
 from lsst.ci.middleware.output_repo_tests import OutputRepoTests
@@ -29,38 +30,51 @@ from lsst.pipe.base.tests.mocks import get_mock_name
 
 # (tract, patch, band): {input visits} for coadds produced here.
 # some visit lists elided because we're just spot-checking.
-EXPECTED = {
-    (0, 0, "r"): {96860, 96862},
-    (0, 0, "i"): {95104},
-    (0, 1, "r"): {96860, 96862},
-    (0, 1, "i"): {95104},
-    (0, 2, "r"): None,
-    (0, 2, "i"): None,
-    (0, 3, "r"): None,
-    (0, 3, "i"): None,
-    (1, 0, "r"): None,
-    (1, 0, "i"): None,
-    # tract=1, patch=1 has only a single i-band input, so no r-band coadd
-    (1, 1, "i"): {96980},
-    (1, 2, "r"): None,
-    (1, 2, "i"): None,
-    # tract=2, patch=3 has only a single i-band input, so no r-band coadd
-    (1, 3, "i"): {96980},
-    (2, 0, "r"): None,
-    (2, 0, "i"): None,
-    (2, 1, "r"): None,
-    (2, 1, "i"): None,
-    # tract=2, patch=2 has only two i-band inputs, so no r-band coadd
-    (2, 2, "i"): {18202, 96954},
-    # tract=2, patch=3 has only two i-band inputs, so no r-band coadd
-    (2, 3, "i"): {18202, 96954},
-    (3, 0, "r"): None,
-    (3, 0, "i"): None,
-    # tract=3, patch=1 has no inputs, and no coadds
-    # tract=3, patch=2 has only a single i-band input, so no r-band coadd
-    (3, 2, "i"): {96954},
-    # tract=3, patch=3 has no inputs, and no coadds
-}
+EXPECTED = MappingProxyType(
+    {
+        (0, 0, "r"): frozenset({96860, 96862}),
+        (0, 0, "i"): frozenset({95104}),
+        (0, 1, "r"): frozenset({96860, 96862}),
+        (0, 1, "i"): frozenset({95104}),
+        (0, 2, "r"): None,
+        (0, 2, "i"): None,
+        (0, 3, "r"): None,
+        (0, 3, "i"): None,
+        (1, 0, "r"): None,
+        (1, 0, "i"): None,
+        # tract=1, patch=1 has only a single i-band input, so no r-band coadd
+        (1, 1, "i"): frozenset({96980}),
+        (1, 2, "r"): None,
+        (1, 2, "i"): None,
+        # tract=2, patch=3 has only a single i-band input, so no r-band coadd
+        (1, 3, "i"): frozenset({96980}),
+        (2, 0, "r"): None,
+        (2, 0, "i"): None,
+        (2, 1, "r"): None,
+        (2, 1, "i"): None,
+        # tract=2, patch=2 has only two i-band inputs, so no r-band coadd
+        (2, 2, "i"): frozenset({18202, 96954}),
+        # tract=2, patch=3 has only two i-band inputs, so no r-band coadd
+        (2, 3, "i"): frozenset({18202, 96954}),
+        (3, 0, "r"): None,
+        (3, 0, "i"): None,
+        # tract=3, patch=1 has no inputs, and no coadds
+        # tract=3, patch=2 has only a single i-band input, so no r-band coadd
+        (3, 2, "i"): frozenset({96954}),
+        # tract=3, patch=3 has no inputs, and no coadds
+    }
+)
+
+# Expected start and content of the error messages for the quanta configured
+# to fail in step1 attempt1.
+CALIBRATE_FAILURE_PREFIX = "Execution of task '_mock_calibrateImage' on quantum"
+CALIBRATE_FAILURE_MESSAGE = "Exception ValueError: Simulated failure: task=_mock_calibrateImage"
+
+# Labels of the tasks whose quanta failed or were blocked in step1 attempt1
+# and were then recovered in attempt2.
+RECOVERED_LABELS = frozenset(
+    {"_mock_calibrateImage", "_mock_writePreSourceTable", "_mock_transformPreSourceTable"}
+)
 
 
 class ProdOutputsTestCase(unittest.TestCase):
@@ -69,6 +83,8 @@ class ProdOutputsTestCase(unittest.TestCase):
     direct: ClassVar[OutputRepoTests]
     qbb: ClassVar[OutputRepoTests]
 
+    maxDiff = None
+
     @classmethod
     def setUpClass(cls) -> None:
         cls.direct = OutputRepoTests("Prod", "direct", EXPECTED)
@@ -79,9 +95,6 @@ class ProdOutputsTestCase(unittest.TestCase):
         cls.direct.close()
         cls.qbb.close()
 
-    def setUp(self) -> None:
-        self.maxDiff = None
-
     def test_direct_qbb_equivalence(self) -> None:
         """Test that the direct and QBB runs produce exactly the same
         collections, dataset types, and datasets."""
@@ -97,13 +110,18 @@ class ProdOutputsTestCase(unittest.TestCase):
                 )
             ),
         )
+        # Compare sorted lists rather than sets, so any difference is reported
+        # as a readable diff.  Both runs use the dataset IDs predicted by the
+        # same QuantumGraphs.
         self.assertEqual(
-            set(self.direct.butler.registry.queryDatasetTypes(...)),
-            set(self.qbb.butler.registry.queryDatasetTypes(...)),
+            sorted(self.direct.butler.registry.queryDatasetTypes(...), key=lambda t: t.name),
+            sorted(self.qbb.butler.registry.queryDatasetTypes(...), key=lambda t: t.name),
         )
         self.assertEqual(
-            set(self.direct.butler.registry.queryDatasets(get_mock_name("isr_config"))),
-            set(self.qbb.butler.registry.queryDatasets(get_mock_name("isr_config"))),
+            sorted(
+                self.direct.butler.registry.queryDatasets(get_mock_name("isr_config")), key=lambda r: r.id
+            ),
+            sorted(self.qbb.butler.registry.queryDatasets(get_mock_name("isr_config")), key=lambda r: r.id),
         )
 
     def test_objects_direct(self) -> None:
@@ -141,23 +159,19 @@ class ProdOutputsTestCase(unittest.TestCase):
         report_1 = QuantumGraphExecutionReport.make_reports(helper.butler, qg_1)
         summary_1 = report_1.to_summary_dict(helper.butler)
         # Check that total between successful, blocked and failed is expected
-        for task in summary_1:
-            self.assertEqual(
-                summary_1[task]["n_expected"],
-                sum(
-                    [
-                        summary_1[task]["n_succeeded"],
-                        summary_1[task]["n_quanta_blocked"],
-                        len(summary_1[task]["failed_quanta"]),
-                    ]
-                ),
-            )
+        self.assertEqual(
+            {task: task_summary["n_expected"] for task, task_summary in summary_1.items()},
+            {
+                task: task_summary["n_succeeded"]
+                + task_summary["n_quanta_blocked"]
+                + len(task_summary["failed_quanta"])
+                for task, task_summary in summary_1.items()
+            },
+        )
         failures = summary_1["_mock_calibrateImage"]["failed_quanta"]
         failed_visits = set()
         for quantum_summary in failures.values():
-            self.assertTrue(
-                quantum_summary["error"][0].startswith("Execution of task '_mock_calibrateImage' on quantum")
-            )
+            self.assertTrue(quantum_summary["error"][0].startswith(CALIBRATE_FAILURE_PREFIX))
             failed_visits.add(quantum_summary["data_id"]["visit"])
         self.assertEqual(failed_visits, {18202})
         self.assertEqual(summary_1["_mock_isr"]["outputs"]["_mock_postISRCCD"]["produced"], 36)
@@ -167,27 +181,23 @@ class ProdOutputsTestCase(unittest.TestCase):
         failures = hr_summary_1["_mock_calibrateImage"]["errors"]
         for failure in failures:
             self.assertEqual(failure["data_id"]["visit"], 18202)
-            self.assertTrue(
-                failure["error"][0].startswith("Execution of task '_mock_calibrateImage' on quantum")
-            )
-            self.assertEqual(hr_summary_1["_mock_isr"]["outputs"]["_mock_postISRCCD"]["produced"], 36)
+            self.assertTrue(failure["error"][0].startswith(CALIBRATE_FAILURE_PREFIX))
+        self.assertEqual(hr_summary_1["_mock_isr"]["outputs"]["_mock_postISRCCD"]["produced"], 36)
         # This task should have succeeded in attempt1 and should not have been
         # included in attempt2.
         qg_2 = helper.get_quantum_graph("step1", "i-attempt2")
         report_2 = QuantumGraphExecutionReport.make_reports(helper.butler, qg_2)
         summary_2 = report_2.to_summary_dict(helper.butler)
         # Check that total between successful, blocked and failed is expected
-        for task in summary_2:
-            self.assertEqual(
-                summary_2[task]["n_expected"],
-                sum(
-                    [
-                        summary_2[task]["n_succeeded"],
-                        summary_2[task]["n_quanta_blocked"],
-                        len(summary_2[task]["failed_quanta"]),
-                    ]
-                ),
-            )
+        self.assertEqual(
+            {task: task_summary["n_expected"] for task, task_summary in summary_2.items()},
+            {
+                task: task_summary["n_succeeded"]
+                + task_summary["n_quanta_blocked"]
+                + len(task_summary["failed_quanta"])
+                for task, task_summary in summary_2.items()
+            },
+        )
         self.assertEqual(summary_2["_mock_calibrateImage"]["failed_quanta"], {})  # is empty ??
         # Making sure it works with the human-readable version,
         hr_summary_2 = report_2.to_summary_dict(helper.butler, human_readable=True)
@@ -230,21 +240,18 @@ class ProdOutputsTestCase(unittest.TestCase):
                     self.assertEqual(task_summary.n_blocked, 0)
                     self.assertEqual(task_summary.n_failed, 6)
                     for quantum_summary in task_summary.failed_quanta:
-                        self.assertEqual(quantum_summary.data_id["instrument"], "HSC")
-                        self.assertIsInstance(quantum_summary.data_id["detector"], int)
-                        self.assertEqual(quantum_summary.data_id["visit"], 18202)
+                        data_id = quantum_summary.data_id
+                        self.assertEqual(data_id["instrument"], "HSC")
+                        self.assertIsInstance(data_id["detector"], int)
+                        self.assertEqual(data_id["visit"], 18202)
                         self.assertDictEqual(
                             quantum_summary.runs, {"HSC/runs/Prod/step1-i-attempt1": "FAILED"}
                         )
                         self.assertIsInstance(quantum_summary.messages, list)
                         for message in quantum_summary.messages:
                             self.assertIsInstance(message, str)
-                            self.assertTrue(
-                                message.startswith("Execution of task '_mock_calibrateImage' on quantum")
-                            )
-                            self.assertIn(
-                                "Exception ValueError: Simulated failure: task=_mock_calibrateImage", message
-                            )
+                            self.assertTrue(message.startswith(CALIBRATE_FAILURE_PREFIX))
+                            self.assertIn(CALIBRATE_FAILURE_MESSAGE, message)
                 case "_mock_writePreSourceTable" | "_mock_transformPreSourceTable":
                     self.assertEqual(task_summary.n_successful, 30)
                     self.assertEqual(task_summary.n_blocked, 6)
@@ -295,15 +302,11 @@ class ProdOutputsTestCase(unittest.TestCase):
             # Check that all the counts add up for every task
             self.assertEqual(
                 dataset_summary.n_expected,
-                sum(
-                    [
-                        dataset_summary.n_visible,
-                        dataset_summary.n_shadowed,
-                        dataset_summary.n_predicted_only,
-                        dataset_summary.n_cursed,
-                        dataset_summary.n_unsuccessful,
-                    ]
-                ),
+                dataset_summary.n_visible
+                + dataset_summary.n_shadowed
+                + dataset_summary.n_predicted_only
+                + dataset_summary.n_cursed
+                + dataset_summary.n_unsuccessful,
             )
             # Check that there are no cursed datasets
             self.assertEqual(dataset_summary.n_cursed, 0)
@@ -341,11 +344,7 @@ class ProdOutputsTestCase(unittest.TestCase):
                 + task_summary.n_wonky
                 + task_summary.n_failed,
             )
-            if (
-                label == "_mock_calibrateImage"
-                or label == "_mock_writePreSourceTable"
-                or label == "_mock_transformPreSourceTable"
-            ):
+            if label in RECOVERED_LABELS:
                 for quantum in task_summary.recovered_quanta:
                     self.assertEqual(quantum["instrument"], "HSC")
                     self.assertEqual(quantum["visit"], 18202)
@@ -366,15 +365,11 @@ class ProdOutputsTestCase(unittest.TestCase):
             # Check that they all add up
             self.assertEqual(
                 dataset_summary.n_expected,
-                sum(
-                    [
-                        dataset_summary.n_visible,
-                        dataset_summary.n_shadowed,
-                        dataset_summary.n_predicted_only,
-                        dataset_summary.n_cursed,
-                        dataset_summary.n_unsuccessful,
-                    ]
-                ),
+                dataset_summary.n_visible
+                + dataset_summary.n_shadowed
+                + dataset_summary.n_predicted_only
+                + dataset_summary.n_cursed
+                + dataset_summary.n_unsuccessful,
             )
             # Check that there are no cursed or unsuccessful datasets
             self.assertEqual(dataset_summary.n_cursed, 0)